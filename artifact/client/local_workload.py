@@ -26,14 +26,13 @@ def main(args):
     benchmark_results = []
     for backend in backends:
         logger.info(f"using backend: {backend['name']}; args: {backend['args']}")
+        # inference runs in this process, the pipeline batches the queries itself
         inference_service = InferenceService(
-            provider=backend["name"],
-            model_parallel_strategy=backend["args"].get(
-                "model_parallel_strategy", "none"
-            ),
             base_model=workload["base_model"],
-            batch_size=backend["args"].get("batch_size", 1),
-            max_num_deltas=backend["args"].get("max_num_deltas", 1),
+            backend=backend["name"],
+            mapping=model_mapping,
+            backend_args=backend["args"],
+            gen_configs={"max_new_tokens": 512},
         )
         logger.info("inference service ready...")
         queries = deepcopy(workload["queries"])
@@ -42,7 +41,7 @@ def main(args):
                 queries[i]["model"] = model_mapping[workload["queries"][i]["model"]]
         queries = [Query(**query) for query in queries]
         start = timer()
-        response = inference_service.generate(queries=queries, max_new_tokens=512)
+        response = inference_service.generate(queries=queries, gpu_id=0)
         end = timer()
         for req, res in zip(queries, response):
             res["model"] = req.model
@@ -4,16 +4,29 @@ import argparse
 import threading
 import numpy as np
 from loguru import logger
-from multiprocessing import Pool
+from requests.adapters import HTTPAdapter
 from timeit import default_timer as timer
 from copy import deepcopy
 
 endpoint = "http://localhost:8000"
 inference_results = []
 
+# share keep-alive connections between the issuing threads
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=16))
+
+
+def size_connection_pool(max_in_flight):
+    # every query is issued from its own thread and holds a connection until its
+    # response arrives, so the pool must fit all queries that can be in flight
+    session.get_adapter(endpoint).close()
+    session.mount(
+        "http://", HTTPAdapter(pool_connections=1, pool_maxsize=max(max_in_flight, 1))
+    )
+
 
 def inference_request(req):
-    res = requests.post(endpoint + "/inference", json=req)
+    res = session.post(endpoint + "/inference", json=req)
     return {
         "response": res.json(),
     }
@@ -38,7 +51,7 @@ def configure_server(
         f"configuring server with backend=[{backend}], base model=[{base_model}], batch size=[{batch_size}], model parallel strategy=[{model_parallel_strategy}]"
     )
 
-    res = requests.post(
+    res = session.post(
         endpoint + "/restart",
         json={
             "backend": backend,
@@ -61,6 +74,7 @@ def issue_queries(queries, backend, mapping=None):
             reformatted_queries[i]["model"] = mapping[query["model"]]
     for idx, query in enumerate(reformatted_queries):
         reformatted_queries[idx]["id"] = str(idx)
+    size_connection_pool(len(reformatted_queries))
     # first find the range of the timestamp
     time_range = [x["timestamp"] for x in queries]
     max_time = max(time_range) + 1  # execute for one more second
@@ -88,6 +102,11 @@ def issue_queries(queries, backend, mapping=None):
     [thread.join() for thread in threads]
     end = timer()
     logger.info("all queries issued")
+    latencies = [x["time_elapsed"] for x in inference_results]
+    if len(latencies) > 0:
+        logger.info(
+            f"latency p50: {np.percentile(latencies, 50):.2f}s, p99: {np.percentile(latencies, 99):.2f}s"
+        )
     return {"results": inference_results, "total_elapsed": end - start}
 
 
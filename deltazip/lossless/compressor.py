@@ -25,17 +25,23 @@ cp_dtype_maps = {
 
 
 class LosslessCompressor:
-    def __init__(self, algorithm: str = "gdeflate", device_id: int = 0) -> None:
+    def __init__(
+        self, algorithm: str = "gdeflate", device_id: int = 0, stream=None
+    ) -> None:
+        # by default nvcomp runs on its own (blocking) stream
+        kwargs = {"device_id": device_id}
+        if stream is not None:
+            kwargs["stream"] = stream
         if algorithm == "gdeflate":
-            self.comp_manager = GdeflateManager(device_id=device_id)
+            self.comp_manager = GdeflateManager(**kwargs)
         elif algorithm == "lz4":
-            self.comp_manager = LZ4Manager(device_id=device_id)
+            self.comp_manager = LZ4Manager(**kwargs)
         elif algorithm == "snappy":
-            self.comp_manager = SnappyManager(device_id=device_id)
+            self.comp_manager = SnappyManager(**kwargs)
         elif algorithm == "bitcomp":
-            self.comp_manager = BitcompManager(device_id=device_id)
+            self.comp_manager = BitcompManager(**kwargs)
         elif algorithm == "cascaded":
-            self.comp_manager = CascadedManager(device_id=device_id)
+            self.comp_manager = CascadedManager(**kwargs)
         else:
             raise ValueError(
                 f"Unsupported algorithm: {algorithm},  supported algorithms: ['gdeflate', 'lz4', 'snappy', 'bitcomp', 'cascaded']"
@@ -84,10 +84,12 @@ class nvCompManager:
 
         Special case: Convert data_type to a _lib.pyNvcompType_t
         """
-        # Special case: Throw error if stream or device_id are specified
-        if kwargs.get("stream") is not None:
+        # Special case: Throw error if stream is not a cupy stream
+        if kwargs.get("stream") is not None and not isinstance(
+            kwargs["stream"], cp.cuda.Stream
+        ):
             raise NotImplementedError(
-                "stream argument not yet supported: " "Use the default argument"
+                "stream argument not yet supported: " "Use a cupy stream"
             )
 
         # data_type will be passed in as a python object. Convert it to
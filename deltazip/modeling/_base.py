@@ -8,7 +8,6 @@ import transformers
 import torch.nn as nn
 from loguru import logger
 from os.path import join, isfile
-from safetensors.numpy import safe_open
 from typing import Dict, List, Optional, Union
 from dataclasses import dataclass, field, fields
 from transformers.utils.hub import PushToHubMixin
@@ -27,6 +26,7 @@ from ._utils import (
     get_device,
     make_quant,
     unpack_model,
+    load_tensors_pinned,
 )
 from ..nn_modules._fused_base import FusedBaseAttentionModule, FusedBaseMLPModule
 from ..core.quant import Quantizer
@@ -660,6 +660,7 @@ class BaseDeltaZipModelForCausalLM(nn.Module, PushToHubMixin):
         compress_config: BaseCompressionConfig,
         max_memory: Optional[dict] = None,
         device_map: Optional[str] = None,
+        use_bfloat16: bool = False,
         **model_init_kwargs,
     ):
         """load un-quantized pretrained model to cpu"""
@@ -682,7 +683,9 @@ class BaseDeltaZipModelForCausalLM(nn.Module, PushToHubMixin):
             raise TypeError(f"{config.model_type} isn't supported yet.")
 
         # enforce some values despite user specified
-        model_init_kwargs["torch_dtype"] = torch.float16
+        model_init_kwargs["torch_dtype"] = (
+            torch.bfloat16 if use_bfloat16 else torch.float16
+        )
         model_init_kwargs["trust_remote_code"] = True
 
         if max_memory:
@@ -756,6 +759,10 @@ class BaseDeltaZipModelForCausalLM(nn.Module, PushToHubMixin):
         low_cpu_mem_usage: bool = False,
         use_bfloat16: bool = False,
         use_exllama: bool = False,
+        # cupy stream to decompress on, nvcomp's own stream by default
+        stream: Optional[cp.cuda.Stream] = None,
+        # releasing cached device memory synchronizes the whole device
+        empty_cache: bool = True,
         **kwargs,
     ):
         """load compressed model from local disk"""
@@ -847,23 +854,18 @@ class BaseDeltaZipModelForCausalLM(nn.Module, PushToHubMixin):
                 )
             # now load compressed data
             losslesscompressor = LosslessCompressor(
-                compress_config.lossless, device_id=0)
-            metadata = None
-            tensors = {}
-
-            with safe_open(model_save_name, framework="numpy") as f:
-                metadata = f.metadata()
-                keys = f.keys()
-                for key in keys:
-                    tensors[key] = f.get_tensor(key)
-            tensor_dtypes = json.loads(metadata["dtype"])
-            tensor_shapes = json.loads(metadata["shape"])
+                compress_config.lossless, device_id=0, stream=stream)
             # (todo: xiaozhe), (todo: minor)
             # seems like we cannot use arbitrary device to decompress
             # for now use device=0 to decompress and then move to target device
+            tensors, metadata = load_tensors_pinned(
+                model_save_name, device=torch.device("cuda", 0)
+            )
+            tensor_dtypes = json.loads(metadata["dtype"])
+            tensor_shapes = json.loads(metadata["shape"])
             with cp.cuda.Device(0):
                 for key in tensors.keys():
-                    tensors[key] = cp.array(tensors[key], copy=False)
+                    tensors[key] = cp.asarray(tensors[key])
             tensors = losslesscompressor.decompress_state_dict(
                 tensors,
                 tensor_shapes,
@@ -901,12 +903,7 @@ class BaseDeltaZipModelForCausalLM(nn.Module, PushToHubMixin):
                 desc_act=compress_config.desc_act,
                 use_exllama=use_exllama,
             )
-            tensors = {}
-            with safe_open(model_save_name, framework="pt") as f:
-                metadata = f.metadata()
-                keys = f.keys()
-                for key in keys:
-                    tensors[key] = f.get_tensor(key)
+            tensors, metadata = load_tensors_pinned(model_save_name, device=device)
         # move tensors to target device
         # print model keys
         missing_keys, unexpected_keys = model.load_state_dict(
@@ -918,7 +915,7 @@ class BaseDeltaZipModelForCausalLM(nn.Module, PushToHubMixin):
             logger.debug(f"unexpected keys: {unexpected_keys}")
         model = model.to(device)
         model = deltazip_post_init(
-            model, use_act_order=compress_config.desc_act)
+            model, use_act_order=compress_config.desc_act, empty_cache=empty_cache)
         model.eval()
         if compress_config.lossless != "none":
             if isinstance(
@@ -959,7 +956,8 @@ class BaseDeltaZipModelForCausalLM(nn.Module, PushToHubMixin):
         if not triton_has_warmup and use_triton:
             QuantLinear.warmup(model, seqlen=model.seqlen)
             triton_has_warmup = True
-        torch.cuda.empty_cache()
+        if empty_cache:
+            torch.cuda.empty_cache()
         return cls(model, True, compress_config)
 
 
@@ -1,9 +1,11 @@
+import os
 from typing import Union, Optional
 import torch
 import transformers
 import torch.nn as nn
 from loguru import logger
 from transformers import AutoConfig
+from safetensors import safe_open
 
 from ._const import SUPPORTED_MODELS, CPU, CUDA_0
 from ..utils.attr_utils import rsetattr
@@ -96,8 +98,44 @@ def make_quant(
         )
 
 
+def load_tensors_pinned(
+    filename: str, device: Optional[Union[str, int, torch.device]] = None
+):
+    """
+    Read all tensors of a safetensors file on cpu and, if device is a cuda device, stage them in pinned memory and copy them asynchronously on a side stream, so that the copy of one tensor overlaps with reading the next one.
+    """
+    if hasattr(os, "posix_fadvise"):
+        # start reading the whole file into the page cache, which is shared with the
+        # mapping safetensors opens below (readahead hints would only apply to this fd)
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    if device is not None:
+        device = torch.device(device)
+    use_cuda = device is not None and device.type == "cuda"
+    tensors = {}
+    with safe_open(filename, framework="pt", device="cpu") as f:
+        metadata = f.metadata()
+        if not use_cuda:
+            for key in f.keys():
+                tensors[key] = f.get_tensor(key)
+            return tensors, metadata
+        stream = torch.cuda.Stream(device=device)
+        with torch.cuda.stream(stream):
+            for key in f.keys():
+                tensor = f.get_tensor(key).pin_memory()
+                tensors[key] = tensor.to(device, non_blocking=True)
+    stream.synchronize()
+    return tensors, metadata
+
+
 def deltazip_post_init(
-    model, use_act_order: bool, max_input_length: Optional[int] = None
+    model,
+    use_act_order: bool,
+    max_input_length: Optional[int] = None,
+    empty_cache: bool = True,
 ):
     """
     The max_input_length argument is specific to the exllama backend, that requires to initialize a buffer temp_state.
@@ -128,7 +166,8 @@ def deltazip_post_init(
             if hasattr(submodule, "QUANT_TYPE"):
                 device = submodule.qweight.device
                 submodule.post_init(temp_dq=model.device_tensors[device])
-    torch.cuda.empty_cache()
+    if empty_cache:
+        torch.cuda.empty_cache()
 
     return model
 
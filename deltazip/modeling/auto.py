@@ -103,6 +103,7 @@ class AutoDeltaZipModelForCausalLM:
             inject_fused_attention=inject_fused_attention,
             inject_fused_mlp=inject_fused_mlp,
             use_cuda_fp16=use_cuda_fp16,
+            use_bfloat16=use_bfloat16,
             compress_config=compress_config,
             model_basename=model_basename,
             use_safetensors=use_safetensors,
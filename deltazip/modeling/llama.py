@@ -3,6 +3,7 @@ from ._utils import *
 from ._base import *
 import transformers
 
+from deltazip.modeling import llama_monkey_patch
 from deltazip.modeling.llama_monkey_patch import (
     llama_attention_forward,
     llama_mlp_forward,
@@ -24,7 +25,9 @@ class LlamaDeltaZipForCausalLM(BaseDeltaZipModelForCausalLM):
     ]
 
 
-def parallelize_llama():
+def parallelize_llama(use_fused_delta: bool = False, quantize_kv_cache: bool = False):
+    llama_monkey_patch.use_fused_delta = use_fused_delta
+    llama_monkey_patch.quantize_kv_cache = quantize_kv_cache
     transformers.models.llama.modeling_llama.LlamaMLP.forward = llama_mlp_forward
     transformers.models.llama.modeling_llama.LlamaAttention.forward = (
         llama_attention_forward
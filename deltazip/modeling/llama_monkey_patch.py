@@ -12,19 +12,62 @@ from transformers.modeling_outputs import (
 from transformers.models.llama.modeling_llama import apply_rotary_pos_emb, repeat_kv
 from loguru import logger
 from deltazip.utils.devices import get_gpu_count
-from deltazip.nn_modules.batched_qlinear import BatchedQuantLinearForward
+from deltazip.nn_modules.batched_qlinear import (
+    BatchedQuantLinearForward,
+    FusedDeltaLinearForward,
+    can_fuse_delta,
+)
 
 DEFAULT_CUDA_DEVICE = 1 if get_gpu_count() > 1 else 0
 BASE_DEVICE = torch.device("cuda", DEFAULT_CUDA_DEVICE)
 
 use_bmm = False
 use_flash_attn = True
+# merge base and delta weights inside one GEMM when the whole batch runs a single delta
+use_fused_delta = False
+# keep the kv cache in int8, halving its memory footprint
+quantize_kv_cache = False
 
 if use_flash_attn:
     torch.backends.cuda.enable_flash_sdp(True)
 
 
+def quantize_kv(x):
+    # symmetric int8 with one scale per (batch, head, token), so new tokens can be
+    # appended without touching the ones already in the cache
+    x = x.float()
+    # the scale is kept in fp32, small scales are subnormal in fp16
+    scale = x.abs().amax(dim=-1, keepdim=True).clamp(min=1e-5) / 127
+    return torch.round(x / scale).clamp_(-127, 127).to(torch.int8), scale
+
+
+def dequantize_kv(x, scale, dtype):
+    return (x.float() * scale).to(dtype)
+
+
+def llama_fused_mlp_forward(self, x):
+    delta = self.delta[0]
+    x = x.to(BASE_DEVICE, non_blocking=True)
+    hidden_states = FusedDeltaLinearForward(x, self.up_proj, delta.up_proj)
+    gate_hidden_states = FusedDeltaLinearForward(x, self.gate_proj, delta.gate_proj)
+    hidden_states = self.act_fn(gate_hidden_states) * hidden_states
+    return FusedDeltaLinearForward(hidden_states, self.down_proj, delta.down_proj)
+
+
 def llama_mlp_forward(self, x):
+    if (
+        use_fused_delta
+        and len(self.delta) > 0
+        and self.delta[0] is not None
+        and all([delta is self.delta[0] for delta in self.delta])
+        and all(
+            [
+                can_fuse_delta(getattr(self, name), getattr(self.delta[0], name))
+                for name in ["up_proj", "gate_proj", "down_proj"]
+            ]
+        )
+    ):
+        return llama_fused_mlp_forward(self, x)
     hidden_states = self.up_proj(x.to(BASE_DEVICE, non_blocking=True))
     gate_hidden_states = self.gate_proj(x.to(BASE_DEVICE, non_blocking=True))
     if use_bmm:
@@ -161,12 +204,34 @@ def llama_attention_forward(
     query_states, key_states = apply_rotary_pos_emb(
         query_states, key_states, cos, sin, position_ids
     )
+    if use_cache and quantize_kv_cache:
+        # the cache is laid out as (key, value, key_scale, value_scale)
+        key_q, key_scale = quantize_kv(key_states)
+        value_q, value_scale = quantize_kv(value_states)
+        new_kv_cache = (key_q, value_q, key_scale, value_scale)
     if past_key_value is not None:
+        if quantize_kv_cache:
+            past_key_states = dequantize_kv(
+                past_key_value[0], past_key_value[2], key_states.dtype
+            )
+            past_value_states = dequantize_kv(
+                past_key_value[1], past_key_value[3], value_states.dtype
+            )
+        else:
+            past_key_states, past_value_states = past_key_value[0], past_key_value[1]
         # reuse k, v, self_attention
-        key_states = torch.cat([past_key_value[0], key_states], dim=2)
-        value_states = torch.cat([past_key_value[1], value_states], dim=2)
-
-    past_key_value = (key_states, value_states) if use_cache else None
+        key_states = torch.cat([past_key_states, key_states], dim=2)
+        value_states = torch.cat([past_value_states, value_states], dim=2)
+
+    if use_cache and quantize_kv_cache:
+        if past_key_value is not None:
+            new_kv_cache = tuple(
+                torch.cat([past, new], dim=2)
+                for past, new in zip(past_key_value, new_kv_cache)
+            )
+        past_key_value = new_kv_cache
+    else:
+        past_key_value = (key_states, value_states) if use_cache else None
 
     # # repeat k/v heads if n_kv_heads < n_heads
     key_states = repeat_kv(key_states, self.num_key_value_groups)
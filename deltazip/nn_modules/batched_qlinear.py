@@ -4,6 +4,7 @@ from typing import List
 from loguru import logger
 from deltazip.nn_modules.qlinear_cuda import QuantLinear
 from deltazip.nn_modules.triton_utils.bmm import quant_bmm_248
+from deltazip.nn_modules.triton_utils.kernels import delta_matmul_248
 
 
 def BatchedQuantLinearForward(inputs, layers: List[QuantLinear]):
@@ -17,6 +18,36 @@ def BatchedQuantLinearForward(inputs, layers: List[QuantLinear]):
     return quant_bmm_248(inputs, b_qweights, b_scales, b_qzeros, b_g_idx, bits, max_q)
 
 
+def can_fuse_delta(base: torch.nn.Linear, delta: QuantLinear):
+    # exllama re-shuffles qweight into its own layout, and 3 bits is not handled by the kernel
+    return (
+        isinstance(delta, QuantLinear)
+        and delta.bits in [2, 4, 8]
+        and not (delta.bits == 4 and delta.use_exllama)
+        and delta.qweight.device == base.weight.device
+    )
+
+
+def FusedDeltaLinearForward(x, base: torch.nn.Linear, delta: QuantLinear):
+    """x @ (base + delta).T, the delta is dequantized inside the GEMM"""
+    out_shape = x.shape[:-1] + (delta.outfeatures,)
+    out = delta_matmul_248(
+        x.reshape(-1, x.shape[-1]).half(),
+        base.weight,
+        delta.qweight,
+        delta.scales,
+        delta.qzeros,
+        delta.g_idx,
+        delta.bits,
+        delta.maxq,
+    ).reshape(out_shape)
+    if base.bias is not None:
+        out = out + base.bias
+    if delta.bias is not None:
+        out = out + delta.bias
+    return out
+
+
 def WarmupBQLForward(models: List, b=8, seqlen=2048):
     """
     ideally we should also support cuda graphs
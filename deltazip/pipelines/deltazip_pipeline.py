@@ -1,15 +1,26 @@
 import os
 import torch
+import functools
+import itertools
+import threading
 import cupy as cp
 from loguru import logger
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import List, Tuple
 from transformers import AutoTokenizer
 from timeit import default_timer as timer
 from deltazip.modeling.llama import parallelize_llama
 from deltazip.modeling.gpt_neox import parallelize_neox
-from deltazip.pipelines.utils import get_gpu_count, get_submodules
+from deltazip.pipelines.utils import (
+    get_gpu_count,
+    get_submodules,
+    batch_to_device,
+)
 from deltazip import BaseCompressionConfig, AutoDeltaZipModelForCausalLM
+from deltazip.modeling._utils import deltazip_post_init
 from deltazip.nn_modules.batched_qlinear import WarmupBQLForward
+from deltazip.nn_modules.qlinear_cuda import QuantLinear
 
 DEFAULT_CUDA_DEVICE = 1 if get_gpu_count() > 1 else 0
 BASE_DEVICE = torch.device("cuda", DEFAULT_CUDA_DEVICE)
@@ -38,15 +49,72 @@ class DeltaZipPipeline:
         lossless_only: bool = False,
         offload_base_model: bool = False,
         warmup_models: List[str] = [],
+        max_delta_memory: float = None,
+        keep_packed_deltas: bool = False,
+        use_bfloat16: bool = False,
+        compile_base_model: bool = False,
+        use_cuda_graphs: bool = False,
+        max_prompt_len: int = None,
+        max_host_deltas: int = 0,
+        use_fused_delta: bool = False,
+        quantize_kv_cache: bool = False,
     ) -> None:
         if placement_strategy not in placement_strategies:
             raise ValueError(
                 f"Unsupported placement strategy: {placement_strategy}, supported strategies are {placement_strategies}"
             )
+        if use_bfloat16 and placement_strategy != "addback":
+            raise ValueError(
+                f"use_bfloat16 is only supported when placement_strategy is addback"
+            )
+        if use_cuda_graphs and max_prompt_len is None:
+            # cuda graphs are recorded per shape, without a fixed prompt length each
+            # new prompt length would record a fresh chain of graphs
+            raise ValueError(f"use_cuda_graphs requires max_prompt_len to be set")
+        # cuda graphs are captured through torch.compile
+        compile_base_model = compile_base_model or use_cuda_graphs
+        if compile_base_model and placement_strategy != "addback":
+            # colocate/separation swap the per-module delta lists on every request,
+            # which would invalidate the compiled graph each time
+            raise ValueError(
+                f"compile_base_model is only supported when placement_strategy is addback"
+            )
+        if use_fused_delta and placement_strategy != "colocate":
+            # separation keeps deltas on other gpus than the base model
+            raise ValueError(
+                f"use_fused_delta is only supported when placement_strategy is colocate"
+            )
+        if quantize_kv_cache and placement_strategy == "addback":
+            # addback runs the unpatched transformers attention
+            raise ValueError(
+                f"quantize_kv_cache is not supported when placement_strategy is addback"
+            )
+        if max_prompt_len is not None and not compile_base_model:
+            # fixed prompt lengths only pay off with a compiled model, otherwise the
+            # padding just adds prefill work (compile_base_model implies addback, so
+            # batches never mix prompts longer than max_prompt_len with shorter ones)
+            raise ValueError(
+                f"max_prompt_len is only supported together with compile_base_model"
+            )
         self.base_model_name = base_model
         self.device_count = get_gpu_count()
         self.offload_base_model = offload_base_model
         self.max_num_deltas = max_num_deltas
+        # upper bound (in GB) of the memory held by resident deltas, None for no bound
+        self.max_delta_memory = max_delta_memory
+        # deltas of one base model have similar sizes, the largest one seen so far is
+        # used as the size of deltas that are not loaded yet
+        self.max_seen_delta_size = 0
+        # evicted deltas are kept in pinned host memory (up to this many), so reloading
+        # them is a host-to-device copy instead of a read and decompression
+        self.max_host_deltas = max_host_deltas
+        # for addback, keep deltas quantized and only unpack them when added to the base model
+        self.keep_packed_deltas = keep_packed_deltas
+        self.use_bfloat16 = use_bfloat16
+        self.compile_base_model = compile_base_model
+        self.use_cuda_graphs = use_cuda_graphs
+        # pad prompts to a fixed length, so the compiled prefill is specialized once
+        self.max_prompt_len = max_prompt_len
         self.batch_size = batch_size
         self.placement_strategy = placement_strategy
         self.placement_args = placement_args
@@ -63,6 +131,10 @@ class DeltaZipPipeline:
         # https://github.com/facebookresearch/llama/issues/380
         self.tokenizer.pad_token = self.tokenizer.bos_token
         self.tokenizer.pad_token_id = self.tokenizer.bos_token_id
+        # workloads repeat prompts a lot, tokenize each distinct prompt only once
+        self._tokenize_one = functools.lru_cache(maxsize=1024)(
+            lambda prompt: tuple(self.tokenizer(prompt).input_ids)
+        )
         # the core assumption of deltazip is that the base model is always loaded, so let's load it when initialize
         self._load_base_model()
         self.lossless_only = lossless_only
@@ -72,42 +144,71 @@ class DeltaZipPipeline:
             )
         if self.placement_strategy != "addback":
             parallelize_neox()
-            parallelize_llama()
-        self.model_pool = {}
+            # fuse the base and delta GEMMs when all rows of a batch use the same delta
+            parallelize_llama(
+                use_fused_delta=use_fused_delta, quantize_kv_cache=quantize_kv_cache
+            )
+        # model pool is kept in LRU order, the least recently used delta comes first
+        self.model_pool = OrderedDict()
+        self.host_pool = OrderedDict()
+        self.delta_sizes = {}
+        # maps delta name to {module name: module} for colocate/separation
+        self.delta_modules = {}
         self.req_count = {}
         self.key_list = []
+        self.colocate_targets = {}
+        # deltas can be loaded in the background (see prefetch), the lock guards the model pool
+        self._pool_lock = threading.RLock()
+        self._loader_pool = ThreadPoolExecutor(max_workers=2)
+        self._pending_loads = {}
+        # deltas being moved to host memory, they can only be restored once that is done
+        self._offloading = {}
         if len(warmup_models) > 0:
             logger.info("Warming up model triton...")
             self._load_deltas(warmup_models)
             WarmupBQLForward([self.model_pool[delta] for delta in warmup_models])
-            self.model_pool = {}
+            self.model_pool = OrderedDict()
+            self.delta_sizes = {}
+            self.delta_modules = {}
             self.req_count = {}
             self.key_list = []
+            self.colocate_targets = {}
+        if self.compile_base_model:
+            self._compile_base_models()
 
         torch.cuda.empty_cache()
 
     @torch.inference_mode()
     def generate(self, queries: List[Tuple], gpu_id: int = 0, **kwargs):
         outputs = []
-        for batch_idx in range(0, len(queries), self.batch_size):
+        # decoding is greedy, so identical (prompt, model) queries yield identical outputs
+        # and only need to be generated once
+        unique_queries = list(dict.fromkeys(queries))
+        for batch_idx in range(0, len(unique_queries), self.batch_size):
             tokenize_start = timer()
-            sub_queries = queries[batch_idx : batch_idx + self.batch_size]
+            sub_queries = unique_queries[batch_idx : batch_idx + self.batch_size]
             batch = self._prepare_batch(sub_queries, self.tokenizer)
+            pad_lens = (batch["attention_mask"] == 0).sum(dim=1).tolist()
             deltas = [x[1] for x in sub_queries]
-            batch_inputs = {k: batch[k] for k in batch}
             tokenize_end = timer()
             for delta in deltas:
                 if delta not in self.req_count and delta != self.base_model_name:
                     self.req_count[delta] = 0
                 elif delta in self.req_count:
                     self.req_count[delta] += 1
-            for k in batch_inputs:
-                batch_inputs[k] = batch_inputs[k].to(f"cuda:{gpu_id}")
+            batch_inputs = batch_to_device(batch, f"cuda:{gpu_id}")
             loading_start = timer()
+            self._wait_for_prefetch(deltas)
             # check if eviction needed, ensure enough memory for loading new deltas
             self._evict_deltas(deltas)
-            self.report_meminfo()
             self._load_deltas(deltas, self.offload_base_model, int(gpu_id))
+            if self.max_delta_memory is not None:
+                # the size of a new delta is only an estimate until it is loaded
+                self._evict_deltas(deltas)
+            with self._pool_lock:
+                for delta in deltas:
+                    if delta in self.model_pool:
+                        self.model_pool.move_to_end(delta)
             loading_end = timer()
             prepare_start = timer()
             self._prepare_inference(deltas, int(gpu_id))
@@ -116,7 +217,10 @@ class DeltaZipPipeline:
             kwargs["do_sample"] = False
             output = self.base_models[int(gpu_id)].generate(**batch_inputs, **kwargs)
             inference_end = timer()
-            output = self.tokenizer.batch_decode(output)
+            # the left padding (bos tokens) is not part of the response
+            output = self.tokenizer.batch_decode(
+                [output[i, pad_len:] for i, pad_len in enumerate(pad_lens)]
+            )
             tokenize_time = tokenize_end - tokenize_start
             loading_time = loading_end - loading_start
             prepare_time = prepare_end - prepare_start
@@ -143,66 +247,278 @@ class DeltaZipPipeline:
             elif self.placement_strategy in ["colocate", "separation"]:
                 self._clear_colocate(int(gpu_id))
             # torch.cuda.empty_cache()
-        return outputs
+        outputs = dict(zip(unique_queries, outputs))
+        return [dict(outputs[query]) for query in queries]
 
     def _load_base_model(self):
         self.base_models = [None for _ in range(self.device_count)]
         logger.info("loading base model")
+        base_model_kwargs = {}
+        if self.hf_token != "":
+            base_model_kwargs["token"] = self.hf_token
         for gpu_id in range(self.device_count):
-            with torch.device("cuda", gpu_id):
-                if self.hf_token == "":
-                    self.base_models[
-                        gpu_id
-                    ] = AutoDeltaZipModelForCausalLM.from_pretrained(
-                        self.base_model_name,
-                        compress_config=dummy_compression_config,
-                        low_cpu_mem_usage=True,
-                    )
-                else:
-                    self.base_models[
-                        gpu_id
-                    ] = AutoDeltaZipModelForCausalLM.from_pretrained(
-                        self.base_model_name,
-                        compress_config=dummy_compression_config,
-                        low_cpu_mem_usage=True,
-                        token=self.hf_token,
-                    )
-            self.base_models[gpu_id] = self.base_models[gpu_id].to(gpu_id)
+            # load weights straight to the target device, in the serving dtype
+            self.base_models[gpu_id] = AutoDeltaZipModelForCausalLM.from_pretrained(
+                self.base_model_name,
+                compress_config=dummy_compression_config,
+                device_map={"": gpu_id},
+                use_bfloat16=self.use_bfloat16,
+                low_cpu_mem_usage=True,
+                **base_model_kwargs,
+            ).model
+        # named_modules() walks the whole model, look modules up in a flat index instead
+        self.base_module_indices = [
+            dict(model.named_modules()) for model in self.base_models
+        ]
         logger.info("based model loaded")
 
+    def _compile_base_models(self):
+        logger.info("compiling base model")
+        for gpu_id in range(self.device_count):
+            model = self.base_models[gpu_id]
+            # addback only updates weights in place, so the compiled graph stays valid across deltas
+            model.forward = torch.compile(
+                model.forward,
+                # reduce-overhead records the forward into cuda graphs and replays them,
+                # removing the per-kernel launch overhead that dominates decoding
+                mode="reduce-overhead" if self.use_cuda_graphs else "default",
+                # with fixed prompt shapes, specialize on the first (prefill) shape and
+                # only fall back to a dynamic graph for the growing decode steps
+                dynamic=None if self.max_prompt_len is not None else True,
+                fullgraph=False,
+            )
+            # pay the compilation cost here rather than on the first request
+            batch = self._prepare_batch([("warmup", None)], self.tokenizer)
+            batch = batch_to_device(batch, f"cuda:{gpu_id}")
+            with torch.inference_mode():
+                model.generate(**batch, max_new_tokens=2, do_sample=False)
+        logger.info("base model compiled")
+
     def _load_delta(self, delta_model: str, device="cuda", force=False):
-        if delta_model in self.model_pool and not force:
-            logger.info(f"delta model {delta_model} already loaded")
-            return
-        logger.info(f"Loading target model {delta_model} to cuda:{device}")
-        self.model_pool[delta_model] = AutoDeltaZipModelForCausalLM.from_compressed(
-            delta_model,
-            device=device,
-            unpack=True
-            if self.placement_strategy == "addback" and not self.lossless_only
-            else False,
-            low_cpu_mem_usage=True,
-            use_triton=True if not self.placement_strategy == "colocate" else False,
-            use_exllama=True if self.placement_strategy == "colocate" else False,
-        )
-        if delta_model not in self.req_count:
-            self.req_count[delta_model] = 0
-        if self.placement_strategy == "addback":
-            self.model_pool[delta_model] = self.model_pool[delta_model].half()
+        with self._pool_lock:
+            if delta_model in self.model_pool and not force:
+                logger.info(f"delta model {delta_model} already loaded")
+                self.model_pool.move_to_end(delta_model)
+                return
+            future = self._pending_loads.get(delta_model)
+            # a finished future may not have been cleared yet
+            if future is None or future.done():
+                # mark the delta as loading, so that a prefetch does not load it again
+                future = Future()
+                self._pending_loads[delta_model] = future
+                is_owner = True
+            else:
+                is_owner = False
+        if not is_owner:
+            # the delta is already being loaded, wait for it instead of loading it twice
+            self._wait_for_prefetch([delta_model])
+            with self._pool_lock:
+                if delta_model in self.model_pool:
+                    return
+            # the other load failed, load it here
+            return self._load_delta(delta_model, device=device, force=force)
+        try:
+            self._fetch_delta(delta_model, device)
+            future.set_result(None)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._finish_load(delta_model, future)
+
+    def _fetch_delta(self, delta_model: str, device, background=False):
+        with self._pool_lock:
+            offloading = self._offloading.get(delta_model)
+        if offloading is not None:
+            offloading.wait()
+        if background:
+            # run the gpu work of the load on its own non-blocking stream, so that it
+            # overlaps with decoding on the default stream instead of queueing behind it
+            stream = cp.cuda.Stream(non_blocking=True)
+            with stream, torch.cuda.stream(torch.cuda.ExternalStream(stream.ptr)):
+                model = self._read_delta(delta_model, device, stream=stream)
+            stream.synchronize()
         else:
-            if len(self.key_list) == 0:
-                # we need to figure out what to merge at this stage
-                for key, _ in self.model_pool[delta_model].model.named_modules():
-                    self.key_list.append(key)
+            model = self._read_delta(delta_model, device)
+        # the delta may be loaded from a background thread, only publish it once ready
+        with self._pool_lock:
+            self.model_pool[delta_model] = model
+            self.delta_sizes[delta_model] = sum(
+                t.numel() * t.element_size() for t in model.state_dict().values()
+            )
+            self.max_seen_delta_size = max(
+                self.max_seen_delta_size, self.delta_sizes[delta_model]
+            )
+            if delta_model not in self.req_count:
+                self.req_count[delta_model] = 0
+            if self.placement_strategy != "addback":
+                self.delta_modules[delta_model] = dict(model.model.named_modules())
+                if len(self.key_list) == 0:
+                    # we need to figure out what to merge at this stage
+                    self.key_list = list(self.delta_modules[delta_model].keys())
+
+    def _read_delta(self, delta_model: str, device, stream=None):
+        # releasing cached memory synchronizes the device, which a background load
+        # must not do while a batch is decoding
+        empty_cache = stream is None
+        with self._pool_lock:
+            host_entry = self.host_pool.get(delta_model)
+            if host_entry is not None:
+                self.host_pool.move_to_end(delta_model)
+        if host_entry is not None:
+            logger.info(f"Restoring delta model {delta_model} from host memory")
+            model, host_tensors = host_entry
+            # copy on a side stream, so the restore does not queue behind the decoding
+            stream = torch.cuda.Stream(device=device)
+            with torch.cuda.stream(stream):
+                # keep the pinned host copy, evicting the delta again then only drops it
+                for name, tensor in self._named_tensors(model):
+                    tensor.data = host_tensors[name].to(device, non_blocking=True)
+            stream.synchronize()
+            if self._uses_exllama(model):
+                # exllama keeps raw pointers to the tensors, which have moved
+                deltazip_post_init(
+                    model.model,
+                    use_act_order=model.compress_config.desc_act,
+                    empty_cache=empty_cache,
+                )
+        else:
+            logger.info(f"Loading target model {delta_model} to cuda:{device}")
+            load_start = timer()
+            model = AutoDeltaZipModelForCausalLM.from_compressed(
+                delta_model,
+                device=device,
+                unpack=True
+                if self.placement_strategy == "addback"
+                and not self.lossless_only
+                and not self.keep_packed_deltas
+                else False,
+                low_cpu_mem_usage=True,
+                use_bfloat16=self.use_bfloat16,
+                use_triton=True if not self.placement_strategy == "colocate" else False,
+                use_exllama=True if self.placement_strategy == "colocate" else False,
+                stream=stream,
+                empty_cache=empty_cache,
+            )
+            logger.info(
+                f"delta model {delta_model} loaded in {timer() - load_start:.2f}s"
+            )
+            if empty_cache:
+                # hand the decompression buffers back, they are only needed to load
+                cp.get_default_memory_pool().free_all_blocks()
+            self.report_meminfo()
+            if self.placement_strategy == "addback":
+                model = model.bfloat16() if self.use_bfloat16 else model.half()
+        return model
+
+    def prefetch(self, delta_model: str):
+        """Starts loading a delta in the background, e.g. as soon as its request arrives,
+        so that reading and decompressing it overlaps with the batches in flight.
+        """
+        if (
+            delta_model == self.base_model_name
+            or self.placement_strategy == "separation"
+        ):
+            return
+        if self.device_count > 1:
+            # the target gpu is only known once the request is dispatched
+            return
+        with self._pool_lock:
+            if delta_model in self.model_pool or delta_model in self._pending_loads:
+                return
+            # prefetching never evicts, deltas in use by the running batch must stay resident
+            if self._needs_eviction(len(self._pending_loads) + 1):
+                return
+            future = self._loader_pool.submit(
+                self._fetch_delta, delta_model, "cuda:0", background=True
+            )
+            self._pending_loads[delta_model] = future
+            future.add_done_callback(lambda f: self._finish_load(delta_model, f))
+
+    def _finish_load(self, delta_model: str, future: Future):
+        with self._pool_lock:
+            if self._pending_loads.get(delta_model) is future:
+                del self._pending_loads[delta_model]
+
+    def _wait_for_prefetch(self, deltas: List[str]):
+        for delta in deltas:
+            with self._pool_lock:
+                future = self._pending_loads.get(delta)
+            if future is None:
+                continue
+            try:
+                future.result()
+            except Exception as e:
+                # fall back to loading the delta on the request path
+                logger.warning(f"prefetching {delta} failed: {e}")
+            # background loads keep their decompression buffers, release them
+            # here, between batches
+            cp.get_default_memory_pool().free_all_blocks()
 
     def _prepare_batch(self, inputs, tokenizer):
         """Tokenizes inputs and sets the batch_lora_ids for the model."""
-        batch = tokenizer([inp[0] for inp in inputs], return_tensors="pt", padding=True)
+        if tokenizer is self.tokenizer:
+            input_ids = [list(self._tokenize_one(inp[0])) for inp in inputs]
+        else:
+            input_ids = tokenizer([inp[0] for inp in inputs]).input_ids
+        if self.max_prompt_len is not None:
+            batch = tokenizer.pad(
+                {"input_ids": input_ids},
+                return_tensors="pt",
+                padding="max_length",
+                max_length=self.max_prompt_len,
+            )
+        else:
+            # multiple-of-8 sequence lengths keep the tensor core shapes aligned
+            batch = tokenizer.pad(
+                {"input_ids": input_ids},
+                return_tensors="pt",
+                padding=True,
+                pad_to_multiple_of=8,
+            )
         return batch
 
-    def _offload_delta(self, delta):
-        self.model_pool[delta] = self.model_pool[delta].to("cpu")
-        torch.cuda.empty_cache()
+    def _named_tensors(self, model):
+        # operate on the inner HF model, the wrapper's to() returns the inner model
+        return itertools.chain(
+            model.model.named_parameters(), model.model.named_buffers()
+        )
+
+    def _uses_exllama(self, model):
+        return any(
+            [hasattr(module, "q_handle") for _, module in model.model.named_modules()]
+        )
+
+    def _offload_delta(self, delta, model):
+        """Moves an evicted delta to pinned host memory, runs outside the lock."""
+        with self._pool_lock:
+            host_entry = self.host_pool.get(delta)
+        if host_entry is None:
+            # pinned memory lets the delta be copied back asynchronously
+            host_tensors = {
+                name: torch.empty_like(tensor, device="cpu", pin_memory=True).copy_(
+                    tensor
+                )
+                for name, tensor in self._named_tensors(model)
+            }
+        else:
+            # deltas are never modified, an earlier host copy is still valid
+            host_tensors = host_entry[1]
+        # drop the device tensors
+        for name, tensor in self._named_tensors(model):
+            tensor.data = host_tensors[name]
+        if self._uses_exllama(model):
+            # the exllama handles reference the device tensors, restoring rebuilds them
+            for _, module in model.model.named_modules():
+                if hasattr(module, "q_handle"):
+                    module.q_tensors = None
+                    module.q_handle = None
+            model.model.device_tensors = {}
+        with self._pool_lock:
+            self.host_pool[delta] = (model, host_tensors)
+            self.host_pool.move_to_end(delta)
+            while len(self.host_pool) > self.max_host_deltas:
+                self.host_pool.popitem(last=False)
 
     def _load_deltas(self, deltas: List[str], offload_base_model=False, gpu_id=0):
         if all([delta == self.base_model_name for delta in deltas]):
@@ -237,47 +553,58 @@ class DeltaZipPipeline:
             )
 
     def report_meminfo(self):
-        # force garbage collection and free memory
-        torch.cuda.empty_cache()
-        cp.get_default_memory_pool().free_all_blocks()
         free, total = torch.cuda.mem_get_info()
-        logger.warning(
+        logger.info(
             f"allocated: pytorch/cupy {torch.cuda.memory_allocated() / 1e9:.2f}/{cp.get_default_memory_pool().used_bytes() / 1e9:.2f} GB"
         )
-        logger.warning(f"PyTorch free/total: {free / 1e9:.2f}/{total / 1e9:.2f} GB")
-
-    def report_meminfo(self):
-        # force garbage collection and free memory
-        torch.cuda.empty_cache()
-        cp.get_default_memory_pool().free_all_blocks()
-        free, total = torch.cuda.mem_get_info()
-        logger.warning(
-            f"PyTorch allocated memory: {torch.cuda.memory_allocated() / 1e9} GB"
-        )
-        logger.warning(
-            f"Cupy allocated memory: {cp.get_default_memory_pool().used_bytes() / 1e9} GB"
-        )
-        logger.warning(f"PyTorch free memory: {free / 1e9} GB")
-        logger.warning(f"PyTorch total memory: {total / 1e9} GB")
+        logger.info(f"PyTorch free/total: {free / 1e9:.2f}/{total / 1e9:.2f} GB")
 
     def _evict_deltas(self, deltas: List[str]):
-        print(f"len model pool: {len(self.model_pool)}")
-        if len(self.model_pool) + len(deltas) > self.max_num_deltas:
-            req_count_loaded = {
-                k: v for k, v in self.req_count.items() if k in self.model_pool
-            }
-            print(f"req_count_loaded: {req_count_loaded}")
-            # sort req_count by value
-            to_evict_models = sorted(req_count_loaded, key=req_count_loaded.get)[
-                : len(deltas)
-            ]
-            to_evict_models = [x for x in to_evict_models if x not in deltas]
-            logger.info(f"evicting {to_evict_models}")
-            for delta in to_evict_models:
+        with self._pool_lock:
+            new_deltas = set(
+                [
+                    delta
+                    for delta in deltas
+                    if delta not in self.model_pool and delta != self.base_model_name
+                ]
+            )
+            # deltas still loading in the background will take a slot as well
+            new_deltas.update(
+                [delta for delta in self._pending_loads if delta not in self.model_pool]
+            )
+            logger.debug(f"len model pool: {len(self.model_pool)}")
+            to_evict_models = []
+            # evict in LRU order, never evict deltas requested by the current batch
+            candidates = [x for x in self.model_pool if x not in deltas]
+            while candidates and self._needs_eviction(len(new_deltas)):
+                delta = candidates.pop(0)
+                to_evict_models.append((delta, self.model_pool.pop(delta)))
+                self.delta_sizes.pop(delta, None)
+                self.delta_modules.pop(delta, None)
+                if self.max_host_deltas > 0:
+                    # a prefetch of this delta must wait until it is in host memory
+                    self._offloading[delta] = threading.Event()
+        if self.max_host_deltas > 0:
+            # copying to host can take a while, it must not block prefetching
+            for delta, model in to_evict_models:
                 try:
-                    del self.model_pool[delta]
-                except KeyError:
-                    pass
+                    self._offload_delta(delta, model)
+                finally:
+                    with self._pool_lock:
+                        self._offloading.pop(delta).set()
+        to_evict_models = [delta for delta, _ in to_evict_models]
+        if len(to_evict_models) > 0:
+            logger.info(f"evicting {to_evict_models}")
+            torch.cuda.empty_cache()
+
+    def _needs_eviction(self, num_new_deltas: int):
+        if len(self.model_pool) + num_new_deltas > self.max_num_deltas:
+            return True
+        if self.max_delta_memory is not None:
+            new_size = num_new_deltas * self.max_seen_delta_size
+            total_size = sum(self.delta_sizes.values()) + new_size
+            return total_size / 1e9 > self.max_delta_memory
+        return False
 
     def _prepare_inference(self, deltas, gpu_id):
         if self.placement_strategy == "addback":
@@ -295,38 +622,73 @@ class DeltaZipPipeline:
 
         if deltas[0] != self.base_model_name:
             logger.info(f"adding delta {deltas[0]} to base model")
-            with torch.no_grad():
-                for name, param in self.model_pool[deltas[0]].model.named_parameters():
-                    self.base_models[gpu_id].state_dict()[name] += param
+            self._apply_addback_delta(deltas[0], gpu_id, alpha=1)
 
     def _prepare_colocate(self, deltas, gpu_id):
-        if all([delta == self.base_model_name for delta in deltas]):
-            for key, dmodule in self.base_models[gpu_id].named_modules():
-                setattr(dmodule, "delta", [None for delta in deltas])
-        for key in self.key_list:
-            _, target, _ = get_submodules(self.base_models[gpu_id], key)
-            dmodules = []
-            for delta in deltas:
-                if delta == self.base_model_name:
-                    dmodules.append(None)
-                else:
-                    for dkey, dmodule in self.model_pool[delta].model.named_modules():
-                        if dkey == key:
-                            dmodules.append(dmodule)
-                            break
-            setattr(target, "delta", dmodules)
+        for key, target in self._colocate_targets(gpu_id):
+            # key_list is only empty if no delta has been loaded, i.e. all deltas are base
+            target.delta = [
+                None
+                if delta == self.base_model_name
+                else self.delta_modules[delta][key]
+                for delta in deltas
+            ]
+
+    def _colocate_targets(self, gpu_id):
+        """(key, module) pairs of the base model whose forward reads a delta attribute"""
+        if len(self.key_list) == 0:
+            return list(self.base_module_indices[gpu_id].items())
+        if gpu_id not in self.colocate_targets:
+            # resolved once, the module structure does not change between requests
+            self.colocate_targets[gpu_id] = [
+                (
+                    key,
+                    get_submodules(
+                        self.base_models[gpu_id], key, self.base_module_indices[gpu_id]
+                    )[1],
+                )
+                for key in self.key_list
+            ]
+        return self.colocate_targets[gpu_id]
+
+    def _delta_tensors(self, delta):
+        """Yields (name, tensor) pairs of the dense delta, unpacking quantized layers on demand."""
+        model = self.model_pool[delta].model
+        # quantized layers only hold buffers, so they are not part of named_parameters
+        for name, param in model.named_parameters():
+            yield name, param
+        for name, module in model.named_modules():
+            if isinstance(module, QuantLinear):
+                linear = module.unpack()
+                yield f"{name}.weight", linear.weight
+                if linear.bias is not None:
+                    yield f"{name}.bias", linear.bias
 
     def _clear_addback_delta(self, delta, gpu_id: int):
         if delta != self.base_model_name:
             logger.info(f"clearing delta {delta} from base model")
             # remove the delta part from the base_model again
-            with torch.no_grad():
-                for name, param in self.model_pool[delta].model.named_parameters():
-                    self.base_models[gpu_id].state_dict()[name] -= param.to(gpu_id)
+            self._apply_addback_delta(delta, gpu_id, alpha=-1)
+
+    @torch.no_grad()
+    def _apply_addback_delta(self, delta, gpu_id: int, alpha: int):
+        base_state_dict = self.base_models[gpu_id].state_dict()
+        if self.keep_packed_deltas:
+            # unpack and apply one layer at a time to bound the peak memory
+            for name, param in self._delta_tensors(delta):
+                base_tensor = base_state_dict[name]
+                base_tensor.add_(param.to(base_tensor.device), alpha=alpha)
+        else:
+            base_tensors = []
+            delta_tensors = []
+            for name, param in self._delta_tensors(delta):
+                base_tensors.append(base_state_dict[name])
+                delta_tensors.append(param.to(base_state_dict[name].device))
+            torch._foreach_add_(base_tensors, delta_tensors, alpha=alpha)
 
     def _clear_colocate(self, gpu_id):
-        for key, dmodule in self.base_models[gpu_id].named_modules():
-            setattr(dmodule, "delta", [])
+        for _, target in self._colocate_targets(gpu_id):
+            target.delta = []
 
     def find_model(self, model_name):
         if model_name in self.model_pool:
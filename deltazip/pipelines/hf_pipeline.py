@@ -5,7 +5,11 @@ import transformers
 from loguru import logger
 from typing import List, Tuple
 from timeit import default_timer as timer
-from deltazip.pipelines.utils import get_available_gpus, get_gpu_count
+from deltazip.pipelines.utils import (
+    get_available_gpus,
+    get_gpu_count,
+    batch_to_device,
+)
 
 placement_strategies = ["tensor-parallel", "no-parallel"]
 
@@ -47,22 +51,19 @@ class HuggingFacePipeline:
         logger.info("Max number of models: {}".format(self.max_num_models))
 
     def report_meminfo(self):
-        # force garbage collection and free memory
-        torch.cuda.empty_cache()
-        cp.get_default_memory_pool().free_all_blocks()
         free, total = torch.cuda.mem_get_info()
-        logger.warning(
+        logger.info(
             f"allocated: pytorch/cupy {torch.cuda.memory_allocated() / 1e9:.2f}/{cp.get_default_memory_pool().used_bytes() / 1e9:.2f} GB"
         )
-        logger.warning(f"PyTorch free/total: {free / 1e9:.2f}/{total / 1e9:.2f} GB")
+        logger.info(f"PyTorch free/total: {free / 1e9:.2f}/{total / 1e9:.2f} GB")
 
     def _evict_deltas(self, deltas: List[str]):
-        print(f"len model pool: {len(self.loaded_models)}")
+        logger.debug(f"len model pool: {len(self.loaded_models)}")
         if len(self.loaded_models) + len(deltas) > self.max_num_models:
             req_count_loaded = {
                 k: v for k, v in self.req_count.items() if k in self.loaded_models
             }
-            print(f"req_count_loaded: {req_count_loaded}")
+            logger.debug(f"req_count_loaded: {req_count_loaded}")
             # sort req_count by value
             to_evict_models = sorted(req_count_loaded, key=req_count_loaded.get)[
                 : len(deltas)
@@ -74,6 +75,8 @@ class HuggingFacePipeline:
                     del self.loaded_models[delta]
                 except KeyError:
                     pass
+            if len(to_evict_models) > 0:
+                torch.cuda.empty_cache()
 
     @torch.inference_mode()
     def generate(self, queries: List[Tuple], gpu_id: int = 0, **kwargs):
@@ -99,11 +102,9 @@ class HuggingFacePipeline:
                 loading_start = timer()
                 for model_name in model_names:
                     self._evict_deltas([model_name])
-                    self.report_meminfo()
                     model_device = self._load_target_model(model_name, gpu_id)
                     # move batch to device
-                    for k in batch_inputs:
-                        batch_inputs[k] = batch_inputs[k].to(f"cuda:{model_device}")
+                    batch_inputs = batch_to_device(batch_inputs, f"cuda:{model_device}")
                     loading_end = timer()
                     inference_start = timer()
                     logger.info("loaded models: {}".format(self.loaded_models.keys()))
@@ -162,6 +163,7 @@ class HuggingFacePipeline:
                     torch.device(f"cuda:{model_device}")
                 )
                 self.device_models[int(model_device)].append(model_name)
+            self.report_meminfo()
         else:
             logger.info(f"{model_name} already loaded, skipping...")
             model_device = None
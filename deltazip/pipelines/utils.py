@@ -1,41 +1,54 @@
 import os
+import torch
 from pynvml import nvmlInit, nvmlDeviceGetCount
 from loguru import logger
 
-nvml_is_initialized = False
-
 
 def initialize():
-    global nvml_is_initialized
-    if not nvml_is_initialized:
-        # respect CUDA_VISIBLE_DEVICES: https://github.com/gpuopenanalytics/pynvml/issues/28
-        os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
-        nvmlInit()
-        nvml_is_initialized = True
-    else:
-        pass
+    # respect CUDA_VISIBLE_DEVICES: https://github.com/gpuopenanalytics/pynvml/issues/28
+    os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
+    nvmlInit()
 
 
 def _get_gpu_count():
-    initialize()
-    return nvmlDeviceGetCount()
+    gpus = os.environ.get("CUDA_VISIBLE_DEVICES", None)
+    if gpus is None:
+        return nvmlDeviceGetCount()
+    return len([x for x in gpus.split(",")])
+
+
+# the set of visible devices is fixed once the process starts, so resolve it once at import
+initialize()
+AVAILABLE_GPUS = list(range(_get_gpu_count()))
 
 
 def get_gpu_count():
-    return len(get_available_gpus())
+    return len(AVAILABLE_GPUS)
 
 
 def get_available_gpus():
-    gpus = os.environ.get("CUDA_VISIBLE_DEVICES", None)
-    if gpus is None:
-        return list(range(_get_gpu_count()))
-    else:
-        total_gpus = len([x for x in gpus.split(",")])
-        return list(range(total_gpus))
+    return AVAILABLE_GPUS
 
 
-def get_submodules(model, key):
-    parent = model.get_submodule(".".join(key.split(".")[:-1]))
-    target_name = key.split(".")[-1]
-    target = model.get_submodule(key)
+def get_submodules(model, key, module_index: dict = None):
+    """module_index is an optional precomputed dict(model.named_modules()) to avoid walking the model"""
+    parent_key, _, target_name = key.rpartition(".")
+    if module_index is None:
+        parent = model.get_submodule(parent_key)
+        target = model.get_submodule(key)
+    else:
+        parent = module_index[parent_key]
+        target = module_index[key]
     return parent, target, target_name
+
+
+def batch_to_device(batch, device):
+    """Copies a tokenized batch to device with one pinned, non-blocking transfer."""
+    keys = list(batch.keys())
+    tensors = [batch[k] for k in keys]
+    if len(set([t.dtype for t in tensors])) != 1 or any([t.is_cuda for t in tensors]):
+        return {k: t.to(device) for k, t in zip(keys, tensors)}
+    # input_ids and attention_mask share shape and dtype, so they fit in one buffer
+    host_buffer = torch.stack(tensors).pin_memory()
+    device_buffer = host_buffer.to(device, non_blocking=True)
+    return dict(zip(keys, device_buffer.unbind(0)))
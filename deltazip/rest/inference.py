@@ -27,25 +27,24 @@ class InferenceService:
             self.pipeline = DeltaZipPipeline(base_model=base_model, **backend_args)
         self.gen_configs = gen_configs
 
+    def _resolve_model(self, model):
+        if self.backend == "hf" or model == self.base_model:
+            return model
+        lossless_only = self.backend_args.get("lossless_only", False)
+        # queries may already carry the delta path, map it back to its model name
+        names = [name for name, path in self.model_mapping.items() if path == model]
+        if len(names) > 0:
+            model = names[0]
+            if not lossless_only or model.endswith("-lossless"):
+                return self.model_mapping[model]
+        if lossless_only and not model.endswith("-lossless"):
+            model = model + "-lossless"
+        return self.model_mapping[model]
+
     def generate(self, queries: List[Tuple], gpu_id):
-        if self.backend == "hf":
-            reformatted_queries = [(x.prompt, x.model) for x in queries]
-        elif self.backend == "deltazip":
-            reformatted_queries = []
-            for x in queries:
-                if x.model == self.base_model:
-                    reformatted_queries.append((x.prompt, x.model))
-                else:
-                    reformatted_queries.append(
-                        (
-                            x.prompt,
-                            self.model_mapping[
-                                x.model
-                                if not self.backend_args["lossless_only"]
-                                else x.model + "-lossless"
-                            ],
-                        )
-                    )
+        reformatted_queries = [
+            (x.prompt, self._resolve_model(x.model)) for x in queries
+        ]
         results = self.pipeline.generate(
             reformatted_queries, gpu_id, **self.gen_configs
         )
@@ -55,5 +54,9 @@ class InferenceService:
     def batch_size(self):
         return self.backend_args["batch_size"]
 
+    def prefetch(self, model_name):
+        if self.backend == "deltazip":
+            self.pipeline.prefetch(self._resolve_model(model_name))
+
     def find_model(self, model_name):
         return self.pipeline.find_model(model_name)
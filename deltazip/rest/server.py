@@ -4,12 +4,13 @@ import random
 import asyncio
 import threading
 import subprocess
-from queue import Queue
+from queue import Queue, Empty
 from loguru import logger
 from typing import Optional
 from fastapi import FastAPI
 from fastapi import FastAPI
 from pydantic import BaseModel
+from timeit import default_timer as timer
 
 from deltazip.rest.inference import InferenceService
 from deltazip.rest.profile import profile_disk_io, get_gpu_name
@@ -18,6 +19,8 @@ app = FastAPI()
 task_queue = Queue()
 
 batch_size = int(os.environ.get("DELTAZIP_BATCH_SIZE", 1))
+# how long to keep the batching window open after the first task arrives
+max_wait_ms = float(os.environ.get("DELTAZIP_MAX_WAIT_MS", 5))
 backend = os.environ.get("DELTAZIP_BACKEND", "hf")
 base_model = os.environ.get("DELTAZIP_BASE_MODEL", "meta-llama/Llama-2-7b-hf")
 cuda_visible_devices = os.environ.get("CUDA_VISIBLE_DEVICES", "0")
@@ -35,34 +38,49 @@ def randomly_clear_disk_cache():
         pass
 
 
+def dispatch_result(task, result):
+    # the waiting request lives on the event loop of the server,
+    # so the future must be resolved from that loop
+    loop, future = results[task.id]
+    loop.call_soon_threadsafe(future.set_result, result)
+
+
 def generation_thread(model, batch, gpu_id):
-    logger.warning(f"processing {[x.id for x in batch]} on gpu {gpu_id}")
+    logger.debug(f"processing {[x.id for x in batch]} on gpu {gpu_id}")
     output = model.generate(batch, gpu_id)
 
     for i, task in enumerate(batch):
-        results[task.id]["result"] = output[i]
-        results[task.id]["event"].set()
+        dispatch_result(task, output[i])
         # randomly_clear_disk_cache()
 
 
+def collect_batch(max_batch_size):
+    # block until the first task arrives, then wait up to max_wait_ms
+    # for more tasks so that they are served in the same batch
+    batch = [task_queue.get()]
+    deadline = timer() + max_wait_ms / 1000
+    while len(batch) < max_batch_size:
+        remaining = deadline - timer()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(task_queue.get(timeout=remaining))
+        except Empty:
+            break
+    return batch
+
+
 class BackgroundTasks(threading.Thread):
     async def _checking(self):
         while True:
-            batch = []
-            for _ in range(batch_size * num_gpus):
-                try:
-                    task = task_queue.get_nowait()
-                    batch.append(task)
-                except:
-                    break
+            batch = collect_batch(batch_size * num_gpus)
             if len(batch) > 0:
                 # sort by id
                 batch = sorted(batch, key=lambda x: int(x.id))
                 if num_gpus == 1:
                     output = inference_model.generate(batch, "0")
                     for i, task in enumerate(batch):
-                        results[task.id]["result"] = output[i]
-                        results[task.id]["event"].set()
+                        dispatch_result(task, output[i])
                         randomly_clear_disk_cache()
                 else:
                     # split batch into sub-batches, per gpu, evenly
@@ -79,7 +97,9 @@ class BackgroundTasks(threading.Thread):
                     # run inference on each gpu, as a new thread
                     # in case we know the model being requested is already on certain GPU, we can directly send the batch to that GPUs
                     threads = []
-                    print(sub_batches)
+                    logger.debug(
+                        f"sub batches: {[[x.id for x in sb] for sb in sub_batches]}"
+                    )
                     for idx, sb in enumerate(sub_batches):
                         if len(sb) > 0:
                             thread = threading.Thread(
@@ -120,11 +140,15 @@ class RestartRequest(BaseModel):
 
 @app.post("/inference", response_model=InferenceTask)
 async def handle_request(inference_task: InferenceTask):
-    event = asyncio.Event()
-    results[inference_task.id] = {"event": event, "result": None}
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    results[inference_task.id] = (loop, future)
+    # start loading the delta while the task waits for its batch, this has to happen
+    # before the task is queued so that the batch waits for this load
+    inference_model.prefetch(inference_task.model)
     task_queue.put(inference_task)
-    await event.wait()
-    response = results.pop(inference_task.id)["result"]
+    response = await future
+    results.pop(inference_task.id)
     inference_task.response = response
     return inference_task
 
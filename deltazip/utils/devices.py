@@ -2,31 +2,28 @@ import os
 from pynvml import nvmlInit, nvmlDeviceGetCount
 from loguru import logger
 
-nvml_is_initialized = False
-
 
 def initialize():
-    global nvml_is_initialized
-    if not nvml_is_initialized:
-        nvmlInit()
-        nvml_is_initialized = True
+    # respect CUDA_VISIBLE_DEVICES: https://github.com/gpuopenanalytics/pynvml/issues/28
+    os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
+    nvmlInit()
 
 
 def _get_gpu_count():
-    initialize()
-    return nvmlDeviceGetCount()
+    gpus = os.environ.get("CUDA_VISIBLE_DEVICES", None)
+    if gpus is None:
+        return nvmlDeviceGetCount()
+    return len([x for x in gpus.split(",")])
+
+
+# the set of visible devices is fixed once the process starts, so resolve it once at import
+initialize()
+AVAILABLE_GPUS = list(range(_get_gpu_count()))
 
 
 def get_gpu_count():
-    return len(get_available_gpus())
+    return len(AVAILABLE_GPUS)
 
 
 def get_available_gpus():
-    # respect CUDA_VISIBLE_DEVICES: https://github.com/gpuopenanalytics/pynvml/issues/28
-    os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
-    gpus = os.environ.get("CUDA_VISIBLE_DEVICES", None)
-    if gpus is None:
-        return list(range(_get_gpu_count()))
-    else:
-        total_gpus = len([x for x in gpus.split(",")])
-        return list(range(total_gpus))
+    return AVAILABLE_GPUS
@@ -1,7 +1,7 @@
 import torch
 from loguru import logger
 from timeit import default_timer as timer
-from deltazip.pipelines import MixedPrecisionModel
+from deltazip.pipelines import DeltaZipPipeline
 from deltazip.utils.randomness import init_seeds
 
 init_seeds(42)
@@ -28,11 +28,11 @@ test_data = test_data * 1
 
 if __name__ == "__main__":
     logger.info("No-parallelism, batch_size=1")
-    mpm = MixedPrecisionModel(
+    mpm = DeltaZipPipeline(
         "meta-llama/Llama-2-7b-hf",
         batch_size=1,
         max_num_deltas=1,
-        model_parallel_strategy="none",
+        placement_strategy="addback",
         use_bfloat16=False,
     )
     start = timer()
@@ -50,12 +50,11 @@ if __name__ == "__main__":
     del mpm
     torch.cuda.empty_cache()
     logger.info("Separate, batch_size=4")
-    mpm = MixedPrecisionModel(
+    mpm = DeltaZipPipeline(
         "meta-llama/Llama-2-7b-hf",
         batch_size=4,
         max_num_deltas=4,
-        use_bfloat16=False,
-        model_parallel_strategy="separation",
+        placement_strategy="separation",
     )
     start = timer()
     results = mpm.generate(
@@ -0,0 +1,36 @@
+import torch
+from deltazip.nn_modules.qlinear_cuda import QuantLinear
+from deltazip.nn_modules.batched_qlinear import FusedDeltaLinearForward, can_fuse_delta
+
+INFEATURES = 4096
+OUTFEATURES = 4096
+SEQLEN = 16
+
+
+def make_delta(bits):
+    maxq = 2**bits - 1
+    scales = torch.rand((OUTFEATURES, 1), dtype=torch.float16) / 100
+    zeros = torch.randint(1, maxq, (OUTFEATURES, 1), dtype=torch.int32)
+    # build the weight from integers in range, so packing is lossless
+    intweight = torch.randint(0, maxq + 1, (OUTFEATURES, INFEATURES))
+    linear = torch.nn.Linear(INFEATURES, OUTFEATURES, bias=False)
+    linear.weight.data = ((intweight - zeros) * scales).float()
+    delta = QuantLinear(bits, INFEATURES, OUTFEATURES, bias=False, use_triton=True)
+    delta.pack(linear, scales.float(), zeros)
+    return delta.to("cuda:0")
+
+
+with torch.inference_mode():
+    base = torch.nn.Linear(INFEATURES, OUTFEATURES, bias=True)
+    base = base.half().to("cuda:0")
+    x = torch.rand((1, SEQLEN, INFEATURES), dtype=torch.float16, device="cuda:0")
+    for bits in [2, 4, 8]:
+        delta = make_delta(bits)
+        assert can_fuse_delta(base, delta)
+        unfused = base(x) + delta(x)
+        fused = FusedDeltaLinearForward(x, base, delta)
+        print(f"bits={bits} max abs diff={(fused - unfused).abs().max().item()}")
+        if torch.allclose(fused, unfused, atol=1e-2, rtol=1e-2):
+            print("✅ match")
+        else:
+            print("❌ differ")
@@ -0,0 +1,52 @@
+import torch
+import transformers
+from deltazip.modeling.llama import parallelize_llama
+
+BATCH_SIZE = 2
+PROMPT_LEN = 64
+NEW_TOKENS = 32
+
+config = transformers.LlamaConfig(
+    hidden_size=1024,
+    intermediate_size=2752,
+    num_hidden_layers=4,
+    num_attention_heads=16,
+)
+
+
+def decode_logits(model, input_ids, next_tokens, quantize_kv_cache):
+    parallelize_llama(quantize_kv_cache=quantize_kv_cache)
+    outputs = model(input_ids=input_ids, use_cache=True)
+    logits = [outputs.logits[:, -1]]
+    # feed the same tokens in both runs, so the logits can be compared step by step
+    for token in next_tokens.unbind(dim=1):
+        outputs = model(
+            input_ids=token[:, None],
+            past_key_values=outputs.past_key_values,
+            use_cache=True,
+        )
+        logits.append(outputs.logits[:, -1])
+    return torch.stack(logits, dim=1).float()
+
+
+with torch.inference_mode():
+    torch.manual_seed(0)
+    model = transformers.LlamaForCausalLM(config).half().to("cuda:0")
+    # the patched forwards expect a delta per row, None runs the base model only
+    for _, module in model.named_modules():
+        module.delta = [None] * BATCH_SIZE
+    input_ids = torch.randint(
+        0, config.vocab_size, (BATCH_SIZE, PROMPT_LEN), device="cuda:0"
+    )
+    next_tokens = torch.randint(
+        0, config.vocab_size, (BATCH_SIZE, NEW_TOKENS), device="cuda:0"
+    )
+    fp16_logits = decode_logits(model, input_ids, next_tokens, False)
+    int8_logits = decode_logits(model, input_ids, next_tokens, True)
+    max_diff = (fp16_logits - int8_logits).abs().max().item()
+    top1_match = (fp16_logits.argmax(-1) == int8_logits.argmax(-1)).float().mean()
+    print(f"max abs logit diff: {max_diff:.4f}, top-1 agreement: {top1_match:.2%}")
+    if torch.allclose(fp16_logits, int8_logits, atol=5e-2, rtol=0):
+        print("✅ match")
+    else:
+        print("❌ differ")